@@ -73,17 +73,22 @@
 # %end
 
 import atexit
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import hashlib
 import json
 import os
 import shutil
 import sys
-import base64
-import urllib.request
+import tempfile
+import time
+import zipfile
 
 import grass.script as grass
 
 try:
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
 except ImportError:
     grass.fatal(
         _(
@@ -96,11 +101,66 @@ except ImportError:
     )
 
 
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+try:
+    from cachecontrol.adapter import CacheControlAdapter
+    from cachecontrol.caches.file_cache import FileCache
+except ImportError:
+    CacheControlAdapter = None
+
+
 rm_folders = []
 curr_path = None
 GIT_URL = "https://github.com/OSGeo/grass-addons"
 RAW_URL = "https://raw.githubusercontent.com/OSGeo/grass-addons"
 API_URL = "https://api.github.com/repos/OSGeo/grass-addons/contents"
+TREES_URL = "https://api.github.com/repos/OSGeo/grass-addons/git/trees"
+ZIP_URL = "https://codeload.github.com/OSGeo/grass-addons/zip"
+# branch references can move, cached API responses for them expire
+# after this many seconds; commit hash references are cached forever
+CACHE_TTL = 300
+
+# one shared session so that all GitHub requests reuse the same
+# TCP + TLS connections
+_SESSION = requests.Session()
+_SESSION.headers["Accept"] = "application/vnd.github+json"
+# GitHub deprecated basic auth for the API, a token header is enough
+if "GITHUB_TOKEN" in os.environ:
+    _SESSION.headers["Authorization"] = f"token {os.environ['GITHUB_TOKEN']}"
+_ADAPTER_OPTS = {
+    "pool_connections": 16,
+    "pool_maxsize": 32,
+    "max_retries": Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 502, 503, 504],
+    ),
+}
+_ADAPTER = HTTPAdapter(**_ADAPTER_OPTS)
+_API_ADAPTER = _ADAPTER
+if CacheControlAdapter is not None:
+    # persist validated API responses across invocations so repeated
+    # installs honour ETag/Cache-Control without extra code
+    try:
+        _API_ADAPTER = CacheControlAdapter(
+            cache=FileCache(
+                os.path.expanduser("~/.cache/g.extension.github")
+            ),
+            **_ADAPTER_OPTS,
+        )
+    except ImportError:
+        # FileCache needs the filelock module, which only comes with
+        # cachecontrol[filecache]
+        pass
+_SESSION.mount("https://api.github.com", _API_ADAPTER)
+_SESSION.mount("https://codeload.github.com", _ADAPTER)
+_SESSION.mount("https://raw.githubusercontent.com", _ADAPTER)
 
 
 def cleanup():
@@ -112,71 +172,244 @@ def cleanup():
         os.chdir(curr_path)
 
 
+_MODULE_CLASS = {
+    "d": "display",
+    "db": "db",
+    "g": "general",
+    "i": "imagery",
+    "m": "misc",
+    "ps": "postscript",
+    "p": "paint",
+    "r": "raster",
+    "r3": "raster3d",
+    "s": "sites",
+    "t": "temporal",
+    "v": "vector",
+    "wx": "gui/wxpython",
+}
+
+
 def get_module_class(module_name):
-    class_letters = module_name.split(".", 1)[0]
-    name = {
-        "d": "display",
-        "db": "db",
-        "g": "general",
-        "i": "imagery",
-        "m": "misc",
-        "ps": "postscript",
-        "p": "paint",
-        "r": "raster",
-        "r3": "raster3d",
-        "s": "sites",
-        "t": "temporal",
-        "v": "vector",
-        "wx": "gui/wxpython",
-    }
-    return name.get(class_letters, class_letters)
-
-
-def urlopen_with_auth(url):
-    request = urllib.request.Request(url)
-    if "GITHUB_TOKEN" in os.environ and "GITHUB_USERNAME" in os.environ:
-        base64string = base64.b64encode((f"{os.environ['GITHUB_USERNAME']}:{os.environ['GITHUB_TOKEN']}").encode())
-        request.add_header("Authorization", "Basic %s" % base64string)
-    return urllib.request.urlopen(request)
+    class_letters = module_name.partition(".")[0]
+    return _MODULE_CLASS.get(class_letters, class_letters)
+
+
+def urlopen_with_auth(url, headers=None):
+    response = _SESSION.get(url, headers=headers)
+    response.raise_for_status()
+    return response
 
 
 def urlretrieve_with_auth(url, path):
-    session = requests.Session()
-    if "GITHUB_TOKEN" in os.environ and "GITHUB_USERNAME" in os.environ:
-        session.auth = (
-            os.environ['GITHUB_USERNAME'],
-            os.environ['GITHUB_TOKEN']
-        )
-    response = session.get(url, stream=True)
-    if response.status_code == 200:
+    with _SESSION.get(url, stream=True) as response:
+        response.raise_for_status()
+        # stream the file to disk in 64KB chunks instead of loading it
+        # into memory as a whole
+        response.raw.decode_content = True
         with open(path, 'wb') as f:
-            f.write(response.content)
+            shutil.copyfileobj(response.raw, f, length=1 << 16)
+
+
+def _cache_file(reference, path):
+    cache_dir = os.path.join(
+        grass.gisenv()["GISDBASE"], ".g.extension.github.cache"
+    )
+    key = hashlib.sha1(f"{reference}:{path}".encode()).hexdigest()
+    return os.path.join(cache_dir, key)
+
+
+def _cache_get(reference, path):
+    """Return (entry, fresh) for the cached API response of
+    (reference, path). A stale entry is returned as well so that its
+    ETag can be replayed as a conditional request."""
+    cache_file = _cache_file(reference, path)
+    if not os.path.isfile(cache_file):
+        return None, False
+    # a full commit hash is immutable, for branches the entry expires
+    fresh = (
+        len(reference) == 40
+        or time.time() - os.path.getmtime(cache_file) <= CACHE_TTL
+    )
+    try:
+        with open(cache_file, "rb") as f:
+            return _loads(f.read()), fresh
+    except (ValueError, OSError):
+        # corrupt or unreadable entry, treat as cache miss and refetch
+        return None, False
+
+
+def _cache_put(reference, path, obj):
+    cache_file = _cache_file(reference, path)
+    cache_dir = os.path.dirname(cache_file)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    # write atomically so that an interrupted run cannot leave a
+    # truncated entry behind
+    fd, tmp_file = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp_file, cache_file)
+
+
+def list_tree(reference):
+    """
+    Listing the whole addons repository tree for a reference with a single
+    Git Trees API call (https://docs.github.com/en/rest/git/trees).
+    """
+    cached, fresh = _cache_get(reference, "trees")
+    if cached is not None and fresh:
+        return cached["body"]
+    headers = None
+    if cached is not None and cached.get("etag"):
+        headers = {"If-None-Match": cached["etag"]}
+    req = urlopen_with_auth(f"{TREES_URL}/{reference}?recursive=1", headers)
+    if req.status_code == 304:
+        # tree is unchanged on the server, reuse and refresh the entry
+        _cache_put(reference, "trees", cached)
+        return cached["body"]
+    tree = _loads(req.content)
+    _cache_put(
+        reference, "trees", {"etag": req.headers.get("ETag"), "body": tree}
+    )
+    return tree
 
 
-def download_git(gitapi_url, git_url, reference, tmp_dir, lstrip=2):
+def download_git_contents(gitapi_url, git_url, reference, tmp_dir, lstrip=2):
     """
-    Downloading a folder of github with urllib.request based on Stefan
+    Downloading a folder of github with the contents API based on Stefan
     Blumentrath code from https://github.com/OSGeo/grass/issues/625.
+    Only used as fallback if the tree listing of the reference is truncated.
+    The folder is walked breadth-first and directory listings share one
+    thread pool with the file downloads, so files are already fetched
+    while further listings are still in flight.
     """
-    req = urlopen_with_auth(f"{gitapi_url}?ref={reference}")
-    content = json.loads(req.read())
-    # directories = []
-    for element in content:
-        path = os.path.join(tmp_dir, *element["path"].split("/")[lstrip:])
-        if not os.path.exists(os.path.dirname(path)):
-            os.makedirs(os.path.dirname(path))
-
-        if element["download_url"] is not None:
-            file = os.path.basename(element["download_url"])
-            url = f"{git_url}/{file}"
-            urlretrieve_with_auth(url, path)
-        else:
-            download_git(
-                f"{gitapi_url}/{element['name']}",
-                f"{git_url}/{element['name']}",
-                reference,
-                tmp_dir
-            )
+    def list_dir(api_url):
+        req = urlopen_with_auth(f"{api_url}?ref={reference}")
+        return _loads(req.content)
+
+    with ThreadPoolExecutor(max_workers=16) as ex:
+        listings = {ex.submit(list_dir, gitapi_url): git_url}
+        downloads = []
+        while listings:
+            done = wait(listings, return_when=FIRST_COMPLETED)[0]
+            for future in done:
+                base_url = listings.pop(future)
+                for element in future.result():
+                    if element["download_url"] is not None:
+                        path = os.path.join(
+                            tmp_dir, *element["path"].split("/")[lstrip:]
+                        )
+                        if not os.path.exists(os.path.dirname(path)):
+                            os.makedirs(os.path.dirname(path))
+                        file = os.path.basename(element["download_url"])
+                        downloads.append(
+                            ex.submit(
+                                urlretrieve_with_auth,
+                                f"{base_url}/{file}",
+                                path,
+                            )
+                        )
+                    else:
+                        listings[
+                            ex.submit(
+                                list_dir, f"{API_URL}/{element['path']}"
+                            )
+                        ] = f"{base_url}/{element['name']}"
+        for future in downloads:
+            future.result()
+
+
+def _candidate_folders(extension_folder):
+    """Return the repo paths the addon may live in. References from
+    before the repository reorganization keep the addons under grass7/
+    instead of src/; no commit API call is needed to decide, both
+    layouts are simply tried."""
+    folders = [extension_folder]
+    if extension_folder.startswith("src/"):
+        folders.append("grass7/" + extension_folder.split("/", 1)[1])
+    return folders
+
+
+def download_snapshot(extension_folder, reference, tmp_dir, lstrip=2):
+    """
+    Downloading the addon folder from a zip snapshot of the reference
+    served by codeload.github.com, so only one HTTP request is needed
+    for all files. The zip format allows random access, only the
+    members of the addon folder are read from the archive.
+    """
+    prefix = tuple(
+        f"{folder}/" for folder in _candidate_folders(extension_folder)
+    )
+    extracted = False
+    with tempfile.TemporaryFile(suffix=".zip") as tmp_zip:
+        with _SESSION.get(f"{ZIP_URL}/{reference}", stream=True) as response:
+            response.raise_for_status()
+            shutil.copyfileobj(response.raw, tmp_zip, length=1 << 16)
+        with zipfile.ZipFile(tmp_zip) as zip_file:
+            for member in zip_file.namelist():
+                # member names are prefixed with the zip top-level
+                # directory, e.g. grass-addons-<reference>/
+                name = member.split("/", 1)[-1]
+                if member.endswith("/") or not name.startswith(prefix):
+                    continue
+                path = os.path.join(tmp_dir, *name.split("/")[lstrip:])
+                if not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with zip_file.open(member) as src, open(path, "wb") as f:
+                    shutil.copyfileobj(src, f)
+                extracted = True
+    if not extracted:
+        raise RuntimeError(
+            f"No files found in repo path {extension_folder}"
+        )
+
+
+def download_git(extension_folder, reference, tmp_dir, lstrip=2):
+    """
+    Downloading an addon folder of github by listing all files with one
+    Git Trees API call and fetching only the files of the addon folder.
+    """
+    tree = list_tree(reference)
+    if tree.get("truncated"):
+        # tree listing is incomplete, walk the addon folder one directory
+        # at a time via the contents API instead
+        download_git_contents(
+            f"{API_URL}/{extension_folder}",
+            f"{RAW_URL}/{reference}/{extension_folder}",
+            reference,
+            tmp_dir,
+            lstrip,
+        )
+        return
+    blobs = []
+    for folder in _candidate_folders(extension_folder):
+        prefix = f"{folder}/"
+        blobs = [
+            element
+            for element in tree["tree"]
+            if element["type"] == "blob"
+            and element["path"].startswith(prefix)
+        ]
+        if blobs:
+            break
+    if not blobs:
+        raise RuntimeError(
+            f"No files found in repo path {extension_folder}"
+        )
+    tasks = [
+        (
+            f"{RAW_URL}/{reference}/{element['path']}",
+            os.path.join(tmp_dir, *element["path"].split("/")[lstrip:]),
+        )
+        for element in blobs
+    ]
+    # create each needed directory only once before the downloads start
+    for directory in {os.path.dirname(path) for _, path in tasks}:
+        os.makedirs(directory, exist_ok=True)
+    # download the files in parallel; ex.map re-raises the first
+    # exception of the workers
+    with ThreadPoolExecutor(max_workers=16) as ex:
+        list(ex.map(lambda task: urlretrieve_with_auth(*task), tasks))
 
 
 def main():
@@ -264,12 +497,36 @@ def main():
         ext_type = get_module_class(extension)
 
         extension_folder = "src/{}/{}".format(ext_type, extension)
-        gitapi_url = f"{API_URL}/{extension_folder}"
-        git_url = f"{RAW_URL}/{reference}/src/{ext_type}/{extension}"
+        # one cheap HEAD per candidate layout to fail fast on typos
+        # before any bulk download starts
+        try:
+            missing = all(
+                _SESSION.head(
+                    f"{API_URL}/{folder}", params={"ref": reference}
+                ).status_code == 404
+                for folder in _candidate_folders(extension_folder)
+            )
+        except requests.RequestException:
+            # e.g. offline; skip the check and let the guarded
+            # download below report the error
+            missing = False
+        if missing:
+            grass.fatal(
+                _(
+                    "Could not find extension in repository.\n"
+                    f"Searching in repo path {extension_folder}\n"
+                    f"for reference {reference}."
+                )
+            )
         new_repo_path = grass.tempdir()
         rm_folders.append(new_repo_path)
         try:
-            download_git(gitapi_url, git_url, reference, new_repo_path)
+            try:
+                download_snapshot(extension_folder, reference, new_repo_path)
+            except Exception:
+                # e.g. zip snapshot request failed; retry with per-file
+                # download via the tree API
+                download_git(extension_folder, reference, new_repo_path)
         except Exception as e:
             grass.fatal(
                 _(